@@ -1,6 +1,6 @@
 # $connect authorizer, validates JWT tokens for WebSocket connections.
 import os
-import json
+import time
 import jwt
 from jwt import PyJWKClient
 from datetime import datetime, timezone
@@ -9,11 +9,33 @@ COGNITO_USERPOOL_ID = os.getenv("COGNITO_USERPOOL_ID")
 COGNITO_REGION      = os.getenv("COGNITO_REGION", "ap-southeast-2")
 EXPECTED_AUDIENCE   = os.getenv("COGNITO_CLIENT_ID")
 EXPECTED_ISSUER     = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USERPOOL_ID}"
+JWKS_URL            = f"{EXPECTED_ISSUER}/.well-known/jwks.json"
+
+# 按 URL 缓存 JWKS client，warm 容器复用已拉取的公钥，避免每次请求都访问 JWKS
+_jwks_clients: dict[str, PyJWKClient] = {}
+
+def _get_jwks_client(url: str) -> PyJWKClient:
+    client = _jwks_clients.get(url)
+    if client is None:
+        client = PyJWKClient(url, cache_keys=True, lifespan=600)
+        _jwks_clients[url] = client
+    return client
+
+# 已验证 token 的短期缓存：token -> (payload, 过期时间)，重连风暴时跳过 RSA 验签
+TOKEN_CACHE_TTL     = int(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_MAXSIZE = 1024
+_token_cache: dict[str, tuple] = {}
 
 def verify_jwt(token: str):
-    jwks_url = f"{EXPECTED_ISSUER}/.well-known/jwks.json"
-    jwks_client = PyJWKClient(jwks_url)
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
+    now = time.time()
+    cached = _token_cache.get(token)
+    if cached is not None:
+        payload, expires_at = cached
+        if now < expires_at:
+            return payload
+        _token_cache.pop(token, None)
+
+    signing_key = _get_jwks_client(JWKS_URL).get_signing_key_from_jwt(token)
     payload = jwt.decode(
         token,
         signing_key.key,
@@ -21,6 +43,12 @@ def verify_jwt(token: str):
         audience=EXPECTED_AUDIENCE,
         issuer=EXPECTED_ISSUER,
     )
+
+    # 缓存时间不超过 token 自身的 exp
+    expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    if len(_token_cache) >= TOKEN_CACHE_MAXSIZE:
+        _token_cache.pop(next(iter(_token_cache)))
+    _token_cache[token] = (payload, expires_at)
     return payload
 
 def generate_policy(principal_id, effect, resource_arn, context=None):
@@ -40,7 +68,6 @@ def generate_policy(principal_id, effect, resource_arn, context=None):
     return policy
 
 def handler(event, context):
-    print(f"[DEBUG] Event: {json.dumps(event)}")
     try:
         token = (event.get("queryStringParameters") or {}).get("token")
         if not token:
@@ -1,29 +1,36 @@
 #Handles WebSocket $connect events.
 import os
-import json
 import logging
 import boto3
+from botocore.config import Config
 from datetime import datetime, timezone
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['CONNECTION_TABLE'])
+# 与其他 handler 相同的 botocore 配置（standard 重试 / keep-alive）；每次调用只有一个请求，使用默认连接池大小
+boto_config = Config(
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+# 直接使用低层 client，跳过 resource 层逐属性的序列化
+ddb = boto3.client('dynamodb', config=boto_config)
+connection_table = os.environ['CONNECTION_TABLE']
 
 def handler(event, context):
-    logger.info(f"ConnectHandler invoked event: {json.dumps(event)}")
+    logger.debug("ConnectHandler invoked event: %s", event)
 
     connection_id = event['requestContext']['connectionId']
     user_id = event['requestContext']['authorizer']['user_id']
     now_iso = datetime.now(timezone.utc).isoformat()
 
     # 写入连接记录
-    table.put_item(Item={
-        'connection_id': connection_id,
-        'user_id': user_id,
-        'connected_at': now_iso,
-        'last_seen': now_iso
+    ddb.put_item(TableName=connection_table, Item={
+        'connection_id': {'S': connection_id},
+        'user_id': {'S': user_id},
+        'connected_at': {'S': now_iso},
+        'last_seen': {'S': now_iso}
     })
 
     return {'statusCode': 200, 'body': 'connected'}
@@ -1,21 +1,28 @@
 # Handles WebSocket $disconnect events.
 import os
-import json
 import logging
 import boto3
+from botocore.config import Config
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['CONNECTION_TABLE'])
+# 与其他 handler 相同的 botocore 配置（standard 重试 / keep-alive）；每次调用只有一个请求，使用默认连接池大小
+boto_config = Config(
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+# 直接使用低层 client，跳过 resource 层逐属性的序列化
+ddb = boto3.client('dynamodb', config=boto_config)
+connection_table = os.environ['CONNECTION_TABLE']
 
 def handler(event, context):
-    logger.info(f"DisconnectHandler invoked event: {json.dumps(event)}")
+    logger.debug("DisconnectHandler invoked event: %s", event)
 
     connection_id = event['requestContext']['connectionId']
 
     # 删除连接记录
-    table.delete_item(Key={'connection_id': connection_id})
+    ddb.delete_item(TableName=connection_table, Key={'connection_id': {'S': connection_id}})
 
     return {'statusCode': 200, 'body': 'disconnected'}
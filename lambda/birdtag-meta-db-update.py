@@ -1,17 +1,29 @@
 # Handles updates to the meta database and sends updates to connected WebSocket clients.
 import os
 import json
+import time
 import logging
+import concurrent.futures
 import boto3
 from decimal import Decimal
-from boto3.dynamodb.conditions import Attr
+from botocore.config import Config
 from boto3.dynamodb.types import TypeDeserializer
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-connections_table = dynamodb.Table(os.environ['CONNECTION_TABLE'])
+# 复用连接池 / keep-alive 的 botocore 配置
+boto_config = Config(
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+# 直接使用低层 client，跳过 resource 层逐属性的序列化
+ddb = boto3.client('dynamodb', config=boto_config)
+connection_table = os.environ['CONNECTION_TABLE']
+# Connections 表上以 user_id 为分区键的 GSI
+connections_user_index = os.environ.get('CONNECTION_USER_INDEX', 'user_id-index')
 
 # 获取 WebSocket 端点
 websocket_endpoint = os.environ.get('WEBSOCKET_ENDPOINT')
@@ -20,32 +32,61 @@ if not websocket_endpoint:
 
 apigw = boto3.client(
     'apigatewaymanagementapi',
-    endpoint_url=websocket_endpoint
+    endpoint_url=websocket_endpoint,
+    config=boto_config
 )
 
+# post_to_connection 并发数；线程池在模块级创建，跨 record 和 warm 调用复用
+POST_MAX_WORKERS = int(os.environ.get('POST_MAX_WORKERS', '16'))
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=POST_MAX_WORKERS)
+
 deserializer = TypeDeserializer()
 
 def _deserialize_ddb_item(new_image):
     """将 DynamoDB Streams 的 NewImage 结构转成普通 Python dict"""
     return {k: deserializer.deserialize(v) for k, v in new_image.items()}
 
-def convert_decimals(obj):
+# UnprocessedItems 最多重发次数（与 batch_writer 一样重发未处理的请求，带指数退避）
+DELETE_MAX_ATTEMPTS = 5
+
+def _delete_connections(conn_ids):
+    """用 BatchWriteItem 批量删除连接记录（每批最多 25 条），被节流未处理的请求退避后重发"""
+    for i in range(0, len(conn_ids), 25):
+        request_items = {connection_table: [
+            {'DeleteRequest': {'Key': {'connection_id': {'S': conn_id}}}}
+            for conn_id in conn_ids[i:i + 25]
+        ]}
+        for attempt in range(DELETE_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+            response = ddb.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                break
+        unprocessed = request_items.get(connection_table)
+        if unprocessed:
+            logger.warning(f"{len(unprocessed)} stale connections were not deleted after {DELETE_MAX_ATTEMPTS} attempts: {unprocessed}")
+
+def _json_default(obj):
     """
-    递归地将 Decimal 类型转换为 int 或 float
+    json.dumps 的 default 钩子：Decimal 转换为 int 或 float，由 C 编码器直接调用，无需递归遍历
     """
     if isinstance(obj, Decimal):
         # 如果是整数，转换为 int，否则转换为 float
         if obj % 1 == 0:
             return int(obj)
         return float(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_decimals(item) for item in obj]
-    return obj
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# 预先构建的 payload 编码器（紧凑分隔符），避免每次 json.dumps 重新创建 JSONEncoder
+_payload_encoder = json.JSONEncoder(default=_json_default, separators=(',', ':'))
+
+def encode_payload(payload):
+    """将 payload 编码为 bytes，post_to_connection 可直接发送"""
+    return _payload_encoder.encode(payload).encode('utf-8')
 
 def handler(event, context):
-    logger.info(f"MetaDbUpdateLambda triggered with event: {json.dumps(event)}")
+    logger.debug("MetaDbUpdateLambda triggered with event: %s", event)
     
     # 记录 WebSocket 端点（用于调试）
     logger.info(f"WebSocket endpoint: {websocket_endpoint}")
@@ -70,7 +111,7 @@ def handler(event, context):
         user_id = item.get('user_id')
         file_id = item.get('file_id')
         thumbnail_url = item.get('thumbnail_url')
-        tags = item.get('tags', {})
+        tags = item.get('tags') or {}
         file_type = item.get('file_type')
         upload_timestamp = item.get('upload_timestamp')
 
@@ -78,9 +119,6 @@ def handler(event, context):
             logger.warning(f"Missing user_id or file_id: user_id={user_id}, file_id={file_id}")
             continue
 
-        # 转换 tags 中的 Decimal 类型
-        tags = convert_decimals(tags) if tags else {}
-
         payload = {
             'type': 'FILE_UPDATE',
             'file_id': file_id,
@@ -91,12 +129,17 @@ def handler(event, context):
         }
 
         logger.info(f"Processing update for file_id={file_id}, user_id={user_id}")
-        logger.info(f"Payload: {json.dumps(payload)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Payload: {_payload_encoder.encode(payload)}")
 
-        # 查询该用户的所有连接
+        # 通过 user_id GSI 查询该用户的所有连接
         try:
-            response = connections_table.scan(
-                FilterExpression=Attr('user_id').eq(user_id)
+            response = ddb.query(
+                TableName=connection_table,
+                IndexName=connections_user_index,
+                KeyConditionExpression='user_id = :u',
+                ExpressionAttributeValues={':u': {'S': user_id}},
+                ProjectionExpression='connection_id'
             )
             connections = response.get('Items', [])
             logger.info(f"Found {len(connections)} connections for user {user_id}")
@@ -108,39 +151,47 @@ def handler(event, context):
             logger.warning(f"No active connections found for user {user_id}")
             continue
 
-        # 推送消息到每个连接
+        # 推送消息到每个连接（payload 只序列化一次，并发发送）
+        data = encode_payload(payload)
         success_count = 0
         failed_count = 0
-        
+        stale_conn_ids = []
+
+        conn_ids = []
         for conn_item in connections:
-            conn_id = conn_item.get('connection_id')
+            conn_id = conn_item.get('connection_id', {}).get('S')
             if not conn_id:
                 logger.warning(f"Connection item missing connection_id: {conn_item}")
                 continue
+            conn_ids.append(conn_id)
 
+        futures = {
+            executor.submit(apigw.post_to_connection, ConnectionId=conn_id, Data=data): conn_id
+            for conn_id in conn_ids
+        }
+        for future in concurrent.futures.as_completed(futures):
+            conn_id = futures[future]
             try:
-                # 直接传 JSON 字符串，不需要 encode
-                apigw.post_to_connection(
-                    ConnectionId=conn_id,
-                    Data=json.dumps(payload)  # 现在可以正常序列化了
-                )
+                future.result()
                 logger.info(f"✅ Successfully sent message to connection: {conn_id}")
                 success_count += 1
             except apigw.exceptions.GoneException:
-                # 连接已失效，删除记录
+                # 连接已失效，稍后批量删除
                 logger.warning(f"Connection {conn_id} is gone, deleting from table")
-                try:
-                    connections_table.delete_item(
-                        Key={'connection_id': conn_id}
-                    )
-                    logger.info(f"Deleted stale connection: {conn_id}")
-                except Exception as e:
-                    logger.error(f"Failed to delete stale connection {conn_id}: {e}")
+                stale_conn_ids.append(conn_id)
                 failed_count += 1
             except Exception as e:
                 logger.error(f"❌ Failed to send to connection {conn_id}: {str(e)}")
                 failed_count += 1
 
+        # 批量删除失效连接
+        if stale_conn_ids:
+            try:
+                _delete_connections(stale_conn_ids)
+                logger.info(f"Deleted stale connections: {stale_conn_ids}")
+            except Exception as e:
+                logger.error(f"Failed to delete stale connections {stale_conn_ids}: {e}")
+
         logger.info(f"Message delivery summary: {success_count} succeeded, {failed_count} failed")
 
     return {'statusCode': 200, 'body': 'processed'}
\ No newline at end of file
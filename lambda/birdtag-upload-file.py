@@ -3,28 +3,72 @@ import json
 import logging
 import boto3
 import uuid
+import concurrent.futures
 import jwt
 from jwt import PyJWKClient
+from botocore.auth import S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from urllib.parse import quote
 from datetime import datetime, timezone
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
+# 复用连接池 / keep-alive 的 botocore 配置
+boto_config = Config(
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 table = dynamodb.Table(os.environ['METADATA_TABLE'])
+s3 = boto3.client('s3', config=boto_config)
+
+# presign 只需要凭证和 region，预先取好，每次调用只跑 SigV4 签名
+PRESIGN_EXPIRES = 3600
+S3_REGION = s3.meta.region_name
+_credentials = boto3.Session().get_credentials()
+
+# 后台线程池：metadata 写入与 presign 计算重叠执行
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
 # Cognito configuration
 COGNITO_USERPOOL_ID = os.getenv('COGNITO_USERPOOL_ID')
 COGNITO_REGION = os.getenv('COGNITO_REGION', 'ap-southeast-2')
 COGNITO_CLIENT_ID = os.getenv('COGNITO_CLIENT_ID')
 EXPECTED_ISSUER = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USERPOOL_ID}"
+JWKS_URL = f"{EXPECTED_ISSUER}/.well-known/jwks.json"
+
+# JWKS clients cached per URL so warm containers reuse the fetched signing keys
+_jwks_clients: dict[str, PyJWKClient] = {}
+
+def _get_jwks_client(url: str) -> PyJWKClient:
+    client = _jwks_clients.get(url)
+    if client is None:
+        client = PyJWKClient(url, cache_keys=True, lifespan=600)
+        _jwks_clients[url] = client
+    return client
+
+def presign_put_url(bucket: str, key: str, content_type: str) -> str:
+    """
+    Presign a PUT for bucket/key, equivalent to generate_presigned_url('put_object').
+    Signs the request directly with SigV4 query auth, skipping the client's
+    request-building pipeline. Content-Type is a signed header, so the upload
+    must send the same value.
+    """
+    url = f"https://{bucket}.s3.{S3_REGION}.amazonaws.com/{quote(key, safe='/~')}"
+    request = AWSRequest(method='PUT', url=url, headers={'Content-Type': content_type})
+    # get_frozen_credentials() 会在临时凭证即将过期时自动刷新
+    signer = S3SigV4QueryAuth(_credentials.get_frozen_credentials(), 's3', S3_REGION, expires=PRESIGN_EXPIRES)
+    signer.add_auth(request)
+    return request.url
 
 def verify_jwt_and_get_user_id(token: str):
     """Verify JWT token and extract user_id"""
     try:
-        jwks_url = f"{EXPECTED_ISSUER}/.well-known/jwks.json"
-        jwks_client = PyJWKClient(jwks_url)
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        signing_key = _get_jwks_client(JWKS_URL).get_signing_key_from_jwt(token)
         payload = jwt.decode(
             token,
             signing_key.key,
@@ -40,7 +84,7 @@ def verify_jwt_and_get_user_id(token: str):
         return None
 
 def handler(event, context):
-    logger.info(f"UploadFileLambda invoked with event: {json.dumps(event)}")
+    logger.debug("UploadFileLambda invoked with event: %s", event)
 
     # Try to get user_id from authorizer context first (if REST API authorizer is configured)
     user_id = event.get('requestContext', {}).get('authorizer', {}).get('user_id')
@@ -71,7 +115,7 @@ def handler(event, context):
     filename = body.get('filename')
     content_type = body.get('content_type')
 
-    file_id = str(uuid.uuid4())
+    file_id = f"{user_id}_{uuid.uuid4().hex}"
     now_iso = datetime.now(timezone.utc).isoformat()
 
     # 推断 file_type
@@ -84,37 +128,43 @@ def handler(event, context):
     else:
         file_type = 'unknown'
 
-    # 构造 S3 key（示例）
-    key = f"{file_type}/{user_id}_{file_id}.{filename.split('.')[-1]}"
-    file_id = f"{user_id}_{file_id}"
+    # 构造 S3 key（示例）；文件名没有扩展名时使用 bin
+    _, dot, ext = filename.rpartition('.')
+    key = f"{file_type}/{file_id}.{ext if dot and ext else 'bin'}"
 
-    # 插入初始 metadata
-    table.put_item(Item={
-        'file_id': file_id,
-        'user_id': user_id,
-        's3_url': None,
-        'thumbnail_url': None,
-        'file_type': file_type,
-        'tags': {},
-        'upload_timestamp': now_iso,
-        'additional_metadata': {}
-    })
-
-    # 生成 presigned URL（举例用 s3 client）
-    s3 = boto3.client('s3')
+    # 插入初始 metadata（后台执行，重试时不覆盖已有记录）
+    put_future = executor.submit(
+        table.put_item,
+        Item={
+            'file_id': file_id,
+            'user_id': user_id,
+            's3_url': None,
+            'thumbnail_url': None,
+            'file_type': file_type,
+            'tags': {},
+            'upload_timestamp': now_iso,
+            'additional_metadata': {}
+        },
+        ConditionExpression='attribute_not_exists(file_id)'
+    )
+
+    # 生成 presigned URL（本地签名，无网络请求）
     bucket = os.environ.get('IMAGES_S3') if file_type=='image' else \
              os.environ.get('VIDEO_S3') if file_type=='video' else \
              os.environ.get('AUDIO_S3') if file_type=='audio' else None
 
     if bucket:
-        presign_url = s3.generate_presigned_url(
-            'put_object',
-            Params={'Bucket': bucket, 'Key': key, 'ContentType': content_type},
-            ExpiresIn=3600
-        )
+        presign_url = presign_put_url(bucket, key, content_type)
     else:
         presign_url = None
 
+    # 返回前确认 metadata 已写入（不设超时：节流重试的退避可能超过数秒）
+    try:
+        put_future.result()
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # file_id 是新生成的 uuid4，条件失败只可能来自本次请求的重试（首次写入已成功但响应丢失）
+        logger.info(f"Metadata for {file_id} already written by an earlier attempt")
+
     response = {
         'file_id': file_id,
         'presign_url': presign_url,
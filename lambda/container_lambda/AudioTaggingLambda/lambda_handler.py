@@ -1,9 +1,11 @@
 import os
 import json
 import logging
+from collections import defaultdict
 from decimal import Decimal
 from datetime import datetime, timedelta
 import boto3
+from botocore.config import Config
 from birdnetlib import Recording
 from birdnetlib.analyzer import Analyzer
 
@@ -14,8 +16,14 @@ REGION = os.getenv('REGION', 'ap-southeast-2')
 AUDIO_BUCKET = os.getenv('AUDIO_BUCKET')
 DDB_TABLE = os.getenv('DDB_TABLE')
 
-s3 = boto3.client('s3', region_name=REGION)
-dynamodb = boto3.resource('dynamodb', region_name=REGION)
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+s3 = boto3.client('s3', region_name=REGION, config=BOTO_CONFIG)
+dynamodb = boto3.resource('dynamodb', region_name=REGION, config=BOTO_CONFIG)
 table = dynamodb.Table(DDB_TABLE)
 
 analyzer = Analyzer()
@@ -28,14 +36,8 @@ def format_timestamp(seconds: float) -> str:
     return f"{h:02d}:{m:02d}:{s:02d}"
 
 def convert_floats(obj):
-
-    if isinstance(obj, float):
-        return Decimal(str(obj))
-    if isinstance(obj, list):
-        return [convert_floats(i) for i in obj]
-    if isinstance(obj, dict):
-        return {k: convert_floats(v) for k, v in obj.items()}
-    return obj
+    # 一次 C 层面的 dumps/loads 往返，把所有 float 转成 DynamoDB 需要的 Decimal
+    return json.loads(json.dumps(obj), parse_float=Decimal)
 
 def lambda_handler(event, context):
     try:
@@ -49,31 +51,29 @@ def lambda_handler(event, context):
         tmp_path = f"/tmp/{filename}"
         s3.download_file(bucket, key, tmp_path)
 
-        resp = table.get_item(Key={'file_id': file_id})
-        item = resp.get('Item', {})
-        upload_ts = item.get('upload_timestamp', datetime.utcnow().isoformat() + 'Z')
-
         recording = Recording(analyzer, tmp_path, min_conf=0.3)
         recording.analyze()
         detections = recording.detections
 
-        tags = {}
+        # 单次遍历记录每个物种的最高置信度，最后统一 round
+        best_conf = defaultdict(float)
         segments = []
         for d in detections:
             name = d['common_name']
-            conf = round(d.get('confidence', 0.0), 2)
-            tags[name] = max(tags.get(name, 0), conf)
+            conf = d.get('confidence', 0.0)
+            if conf > best_conf[name]:
+                best_conf[name] = conf
             segments.append({
                 "start_time": format_timestamp(d.get('start_time', 0.0)),
                 "end_time":   format_timestamp(d.get('end_time',   0.0)),
                 "species":    name,
-                "confidence": conf
+                "confidence": round(conf, 2)
             })
+        tags = {name: round(conf, 2) for name, conf in best_conf.items()}
 
 
         updated_item = {
             "file_id":            file_id,
-            "upload_timestamp":   upload_ts,
             "s3_url":             f"https://{AUDIO_BUCKET}.s3.amazonaws.com/{key}",
             "thumbnail_url":      "NULL",
             "file_type":          "audio",
@@ -86,7 +86,26 @@ def lambda_handler(event, context):
         updated_item = convert_floats(updated_item)
 
 
-        table.put_item(Item=updated_item)
+        # 单次 UpdateItem 只写变化的字段；upload_timestamp 仅在缺失时补上，无需先 get_item
+        table.update_item(
+            Key={'file_id': file_id},
+            UpdateExpression=(
+                "SET #s = :done, s3_url = :u, thumbnail_url = :t, file_type = :ft, "
+                "tags = :tg, additional_metadata = :m, "
+                "upload_timestamp = if_not_exists(upload_timestamp, :ts)"
+            ),
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={
+                ':done': updated_item['status'],
+                ':u':    updated_item['s3_url'],
+                ':t':    updated_item['thumbnail_url'],
+                ':ft':   updated_item['file_type'],
+                ':tg':   updated_item['tags'],
+                ':m':    updated_item['additional_metadata'],
+                ':ts':   datetime.utcnow().isoformat() + 'Z',
+            },
+            ReturnValues='NONE'
+        )
 
 
         try:
@@ -2,10 +2,12 @@ import os
 import json
 import time
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from ultralytics import YOLO
 import supervision as sv
 import cv2 as cv
+import numpy as np
 
 # ===== 配置 =====
 REGION         = os.getenv("AWS_REGION", "ap-southeast-2")
@@ -13,27 +15,44 @@ IMAGES_BUCKET_ENV = os.getenv("IMAGES_S3")      # 可选：如果你希望 s3_ur
 METADATA_TABLE = os.getenv("METADATA_TABLE")
 MODEL_PATH     = os.getenv("MODEL_PATH", "/opt/model.pt")
 
-s3_client  = boto3.client("s3",  region_name=REGION)
-ddb_client = boto3.client("dynamodb", region_name=REGION)
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "standard", "max_attempts": 3},
+    tcp_keepalive=True,
+)
 
-# ===== YOLO 模型懒加载 =====
+s3_client  = boto3.client("s3", region_name=REGION, config=BOTO_CONFIG)
+ddb_client = boto3.client("dynamodb", region_name=REGION, config=BOTO_CONFIG)
+
+# ===== DynamoDB 更新模板（模块加载时构造，调用时只填值）=====
+# thumbnail_url 由 thumbnail_lambda 在缩略图上传完成后写入，这里不写
+UPDATE_EXPR = "SET #S = :done, file_type = :ft, s3_url = :s, tags = :tg, upload_timestamp = :u"
+UPDATE_EXPR_NAMES = {"#S": "status"}
+DONE_ATTR         = {"S": "DONE"}
+FILE_TYPE_ATTR    = {"S": "Image"}
+
+# ===== YOLO 模型加载（在 INIT 阶段执行，见下方 get_model() 调用）=====
 _model = None
+_class_names = None  # class id -> class name 的 ndarray 查找表
 def get_model():
-    global _model
+    global _model, _class_names
     if _model is None:
-        _model = YOLO(MODEL_PATH)
+        _model = YOLO(MODEL_PATH, task="detect")
+        _class_names = np.asarray([_model.names[i] for i in range(len(_model.names))])
+        # 只有 PyTorch 权重支持 Conv+BN 融合，ONNX 图在导出时已优化
+        if MODEL_PATH.endswith(".pt"):
+            _model.fuse()
+        # 预热一次推理，强制加载权重并初始化算子
+        _model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
     return _model
 
-def get_detect_counts(image_path: str, confidence: float = 0.5) -> dict:
+get_model()
+
+def get_detect_counts(img, confidence: float = 0.5) -> dict:
     """
-    使用 YOLO 对图片进行推理，返回 {class_name: count} 的统计字典
+    使用 YOLO 对已解码的图片 (BGR ndarray) 进行推理，返回 {class_name: count} 的统计字典
     """
     model = get_model()
-    class_dict = model.names  # id -> class name
-
-    img = cv.imread(image_path)
-    if img is None:
-        raise RuntimeError(f"cannot read image: {image_path}")
 
     result = model(img)[0]
     detections = sv.Detections.from_ultralytics(result)
@@ -44,10 +63,11 @@ def get_detect_counts(image_path: str, confidence: float = 0.5) -> dict:
         detections = sv.Detections.empty()
 
     counts = {}
-    if detections.class_id is not None:
-        for cls_id in detections.class_id.tolist():
-            species = class_dict[int(cls_id)]
-            counts[species] = counts.get(species, 0) + 1
+    if detections.class_id is not None and len(detections.class_id):
+        # 向量化：按 class id 索引出物种名，再一次性计数
+        species_arr = _class_names[detections.class_id.astype(np.int64)]
+        uniq, cnts = np.unique(species_arr, return_counts=True)
+        counts = dict(zip(uniq.tolist(), cnts.tolist()))
 
     return counts
 
@@ -59,7 +79,8 @@ def handler(event, context):
     - event["detail"]["bucket"]["name"] 为 bucket
     - event["detail"]["object"]["key"] 为对象 key，例如 "image/xxx.jpg"
     """
-    print(f"[DEBUG] Raw Event: {json.dumps(event)}")
+    # 本次调用的时间戳只计算一次
+    now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
     # 从 EventBridge S3 事件中取 bucket / key
     detail = event.get("detail", {})
@@ -81,21 +102,15 @@ def handler(event, context):
             "body": json.dumps({"message": "Ignored non-image object"})
         }
 
-    # 从 key 中解析 file_id 和扩展名
+    # 从 key 中解析 file_id
     # 例如 key = "image/abcd-1234.jpg"
     filename = os.path.basename(key)         # "abcd-1234.jpg"
-    if "." in filename:
-        file_id, ext = filename.rsplit(".", 1)
-    else:
-        file_id, ext = filename, "jpg"
-    ext = ext or "jpg"
-
-    tmp_path = f"/tmp/{file_id}.{ext}"
+    file_id  = filename.rsplit(".", 1)[0]
 
-    # ===== 从 S3 下载图片（走 AWS 内部网络，不用 presigned url）=====
+    # ===== 从 S3 读取图片到内存（走 AWS 内部网络，不用 presigned url，不落盘）=====
     try:
-        s3_client.download_file(bucket, key, tmp_path)
-        print(f"[INFO] S3 download complete: s3://{bucket}/{key} -> {tmp_path}")
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        print(f"[INFO] S3 download complete: s3://{bucket}/{key} ({len(body)} bytes)")
     except ClientError as e:
         print(f"[ERROR] S3 download failed: {e}")
         return {
@@ -105,7 +120,10 @@ def handler(event, context):
 
     # ===== 模型推理 =====
     try:
-        counts = get_detect_counts(tmp_path, confidence=0.5)
+        img = cv.imdecode(np.frombuffer(body, dtype=np.uint8), cv.IMREAD_COLOR)
+        if img is None:
+            raise RuntimeError(f"cannot decode image: s3://{bucket}/{key}")
+        counts = get_detect_counts(img, confidence=0.5)
         print(f"[INFO] model run complete: {counts}")
     except Exception as e:
         print(f"[ERROR] model run failed: {e}")
@@ -117,28 +135,24 @@ def handler(event, context):
     s3_url = f"https://{images_bucket_for_url}.s3.amazonaws.com/{key}"
 
     # ===== 写入 / 更新 DynamoDB =====
-    now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     tags_map = {species: {"N": str(cnt)} for species, cnt in counts.items()}
 
     try:
         ddb_client.update_item(
             TableName=METADATA_TABLE,
             Key={"file_id": {"S": file_id}},
-            UpdateExpression=(
-                "SET #S = :done, "
-                "file_type = :ft, "
-                "s3_url = :s, "
-                "tags = :tg, "
-                "upload_timestamp = :u"
-            ),
-            ExpressionAttributeNames={"#S": "status"},
+            UpdateExpression=UPDATE_EXPR,
+            ExpressionAttributeNames=UPDATE_EXPR_NAMES,
             ExpressionAttributeValues={
-                ":done": {"S": "DONE"},
-                ":ft":   {"S": "Image"},
+                ":done": DONE_ATTR,
+                ":ft":   FILE_TYPE_ATTR,
                 ":s":    {"S": s3_url},
                 ":tg":   {"M": tags_map},
                 ":u":    {"S": now_iso},
             },
+            # 不需要返回旧/新属性和容量信息，减小响应体
+            ReturnValues="NONE",
+            ReturnConsumedCapacity="NONE",
         )
         print(
             f"[INFO] DynamoDB updated: file_id={file_id}, "
@@ -149,12 +163,6 @@ def handler(event, context):
         # 根据需要决定是否要抛出异常让 Lambda 失败重试
         raise
 
-    # ===== 清理临时文件 =====
-    try:
-        os.remove(tmp_path)
-    except OSError:
-        pass
-
     return {
         "statusCode": 200,
         "body": json.dumps(
@@ -2,13 +2,25 @@
 # coding: utf-8
 
 import os
+import io
 import json
+import math
+import struct
 import time
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from ultralytics import YOLO
 import supervision as sv
 import cv2 as cv
+import numpy as np
+import torch
+
+try:
+    from decord import VideoReader, cpu
+except ImportError:  # decord 不可用时回退到 OpenCV 逐帧解码
+    VideoReader = None
 
 # ===== 配置 =====
 REGION         = os.getenv("AWS_REGION", "ap-southeast-2")
@@ -16,48 +28,250 @@ VIDEO_BUCKET_ENV = os.getenv("VIDEO_S3")      # 可选：如果你希望 s3_url
 THUMB_BUCKET   = os.getenv("THUMBNAILS_S3")
 METADATA_TABLE = os.getenv("METADATA_TABLE")
 MODEL_PATH     = os.getenv("MODEL_PATH", "/opt/model.pt")
+TRACK_FPS      = max(1, int(os.getenv("TRACK_FPS", "10")))   # 跟踪计数用的抽帧帧率（至少 1）
+BATCH_SIZE     = max(1, int(os.getenv("YOLO_BATCH", "16")))  # 每次 YOLO 推理的帧数（至少 1）
+STALL_SECONDS  = int(os.getenv("STALL_SECONDS", "30"))  # 连续多少秒没有新 track 就提前结束，0 表示不提前结束
+IMGSZ          = int(os.getenv("YOLO_IMGSZ", "640"))  # 推理输入的长边尺寸
+# 有 CUDA 且为 PyTorch 权重时用 FP16 推理
+USE_HALF       = torch.cuda.is_available() and MODEL_PATH.endswith(".pt")
+
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "standard", "max_attempts": 3},
+    tcp_keepalive=True,
+)
+
+# 所有 client 共用一个模块级 Session，warm 调用复用凭证解析与连接池
+boto_session = boto3.session.Session(region_name=REGION)
+s3_client  = boto_session.client("s3", config=BOTO_CONFIG)
+ddb_client = boto_session.client("dynamodb", config=BOTO_CONFIG)
 
-s3_client  = boto3.client("s3", region_name=REGION)
-ddb_client = boto3.client("dynamodb", region_name=REGION)
+# 视频下载使用的分段并发配置
+TRANSFER_CONFIG = TransferConfig(multipart_chunksize=8 << 20, max_concurrency=10, use_threads=True)
 
-# ===== YOLO 模型懒加载 =====
+# ===== DynamoDB 更新模板（模块加载时构造，调用时只填值）=====
+# 未配置 THUMBNAILS_S3 时不写 thumbnail_url，避免写入 https://None.s3... 这样的地址
+UPDATE_EXPR = "SET #S = :done, file_type = :ft, s3_url = :s, tags = :tg, upload_timestamp = :u"
+if THUMB_BUCKET:
+    UPDATE_EXPR += ", thumbnail_url = :t"
+else:
+    print("[WARN] THUMBNAILS_S3 is not set, thumbnail_url will not be written")
+UPDATE_EXPR_NAMES = {"#S": "status"}
+DONE_ATTR         = {"S": "DONE"}
+FILE_TYPE_ATTR    = {"S": "Video"}
+
+# ===== YOLO 模型加载（在 INIT 阶段执行，见下方 get_model() 调用）=====
 _model = None
 def get_model():
     global _model
     if _model is None:
-        _model = YOLO(MODEL_PATH)
+        _model = YOLO(MODEL_PATH, task="detect")
+        # 只有 PyTorch 权重支持 Conv+BN 融合，ONNX 图在导出时已优化
+        if MODEL_PATH.endswith(".pt"):
+            _model.fuse()
+        # 有 CUDA 时把权重放到 GPU，推理时用 FP16
+        if USE_HALF:
+            _model.to("cuda")
+        # 按实际调用方式（张量输入）预热一帧，强制加载权重并初始化算子（CUDA 下包括 cuDNN autotune）；
+        # 只跑一帧，控制 INIT 时长（INIT 超过 10s 会在计费的调用里重做）
+        _model.predict(
+            source=_stage_batch([np.zeros((360, 640, 3), dtype=np.uint8)]),
+            half=USE_HALF,
+            verbose=False,
+        )
     return _model
 
-def video_predict_unique_counts(video_path: str, confidence: float = 0.5) -> dict:
-    video_info = sv.VideoInfo.from_video_path(video_path=video_path)
-    fps = int(video_info.fps)
-    class_dict = get_model().names
+def _iter_mp4_boxes(buf, start: int, end: int):
+    """
+    遍历 [start, end) 范围内的 MP4 box，产出 (box 类型, payload 起点, box 终点)
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from(">Q", buf, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def _mp4_rotation_k(buf) -> int:
+    """
+    decord 不会应用 display matrix 旋转（OpenCV 默认会，CAP_PROP_ORIENTATION_AUTO）。
+    直接从 MP4/MOV 视频轨 tkhd 的变换矩阵读取旋转角度，只解析 box 头，不解复用、不解码；
+    返回把画面摆正所需的 np.rot90 k（0~3），非 MP4/MOV 或没有旋转时返回 0
+    """
+    end = len(buf)
+    for moov_type, moov_start, moov_end in _iter_mp4_boxes(buf, 0, end):
+        if moov_type != b"moov":
+            continue
+        for trak_type, trak_start, trak_end in _iter_mp4_boxes(buf, moov_start, moov_end):
+            if trak_type != b"trak":
+                continue
+            matrix, is_video = None, False
+            for box_type, start, box_end in _iter_mp4_boxes(buf, trak_start, trak_end):
+                if box_type == b"tkhd":
+                    # version 1 的时间字段是 64 位；矩阵前面还有 reserved/layer/alternate_group/volume
+                    offset = start + (36 if buf[start] == 1 else 24) + 16
+                    if offset + 16 <= box_end:
+                        matrix = struct.unpack_from(">4i", buf, offset)  # a, b, u, c
+                elif box_type == b"mdia":
+                    for sub_type, sub_start, sub_end in _iter_mp4_boxes(buf, start, box_end):
+                        if sub_type == b"hdlr" and sub_start + 12 <= sub_end:
+                            is_video = bytes(buf[sub_start + 8:sub_start + 12]) == b"vide"
+            if is_video and matrix is not None:
+                a, b = matrix[0], matrix[1]
+                # 与 FFmpeg av_display_rotation_get 一致：逆时针角度为 -atan2(b, a)
+                return round(-math.degrees(math.atan2(b, a)) / 90) % 4
+    return 0
+
+def _iter_decord_batches(vr, stride: int, batch_size: int, rot_k: int = 0):
+    """
+    用 decord 按 stride 抽帧并整批解码，每批 batch_size 帧（RGB，形状 B x H x W x 3）；
+    rot_k 非 0 时整批旋转摆正（竖屏手机视频）
+    """
+    indices = range(0, len(vr), stride)
+    for i in range(0, len(indices), batch_size):
+        batch = vr.get_batch(list(indices[i:i + batch_size])).asnumpy()
+        if rot_k:
+            batch = np.ascontiguousarray(np.rot90(batch, rot_k, axes=(1, 2)))
+        yield batch
+
+def _iter_frame_batches(cap, stride: int, batch_size: int):
+    """
+    OpenCV 回退路径：每 stride 帧取一帧，转为 RGB 后按 batch_size 分批产出；跳过的帧只 grab 不 retrieve
+    """
+    batch = []
+    frame_idx = 0
+    while cap.grab():
+        if frame_idx % stride == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                batch.append(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        frame_idx += 1
+    if batch:
+        yield batch
+
+_stage_buf = None
+def _stage_batch(frames) -> torch.Tensor:
+    """
+    把一批同尺寸 RGB 帧等比缩放到长边 IMGSZ，左上对齐写入复用的 uint8 缓冲区
+    （填充到 32 的倍数，灰色 114 与 YOLO letterbox 一致），再整批转成 BCHW 0~1 张量
+    """
+    global _stage_buf
+    h, w = frames[0].shape[:2]
+    r = min(IMGSZ / h, IMGSZ / w)
+    nh, nw = round(h * r), round(w * r)
+    shape = (BATCH_SIZE, -(-nh // 32) * 32, -(-nw // 32) * 32, 3)
+    if _stage_buf is None or _stage_buf.shape != shape:
+        _stage_buf = np.full(shape, 114, dtype=np.uint8)
+
+    for i, frame in enumerate(frames):
+        if (h, w) == (nh, nw):
+            _stage_buf[i, :nh, :nw] = frame
+        else:
+            _stage_buf[i, :nh, :nw] = cv.resize(frame, (nw, nh), interpolation=cv.INTER_LINEAR)
+
+    tensor = torch.from_numpy(_stage_buf[:len(frames)]).permute(0, 3, 1, 2)
+    if USE_HALF:
+        tensor = tensor.cuda(non_blocking=True).half()
+    else:
+        tensor = tensor.float()
+    return tensor.contiguous().div_(255.0)
+
+def video_predict_unique_counts(video_source, confidence: float = 0.5, fallback_path: str = None) -> dict:
+    """
+    video_source 为本地路径；decord 可用时也可以是内存中的 BytesIO。
+    decord 打不开内存中的视频时，把内容写到 fallback_path，改用 OpenCV 逐帧解码
+    """
+    model      = get_model()
+    class_dict = model.names
+
+    # 只打开一次视频，fps 直接取解码器的元数据；旋转角度直接从内存中的 MP4 头读取
+    vr = cap = None
+    if VideoReader is not None:
+        try:
+            rot_k = 0
+            if isinstance(video_source, io.BytesIO):
+                with video_source.getbuffer() as buf:
+                    rot_k = _mp4_rotation_k(buf)
+            vr  = VideoReader(video_source, ctx=cpu(0))
+            fps = int(vr.get_avg_fps() or 30)
+        except Exception as e:
+            # decord 不支持的容器 / 编码：落盘后走 OpenCV 路径（与原来的 VideoCapture 行为一致）
+            print(f"[WARN] decord cannot open video, fall back to OpenCV: {e}")
+            vr = None
+            if isinstance(video_source, io.BytesIO):
+                if not fallback_path:
+                    raise
+                with open(fallback_path, "wb") as f, video_source.getbuffer() as buf:
+                    f.write(buf)
+        # decord 会把 file-like 的内容复制到自己的 bytearray；确定走哪条路径后立即释放 BytesIO，避免整段视频在内存里存两份
+        if isinstance(video_source, io.BytesIO):
+            video_source.close()
+            if vr is None:
+                video_source = fallback_path
+    if vr is None:
+        cap = cv.VideoCapture(video_source)
+        if not cap.isOpened():
+            raise RuntimeError(f"cannot open video：{video_source}")
+        fps = int(cap.get(cv.CAP_PROP_FPS) or 30)
 
-    cap = cv.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"cannot open video：{video_path}")
+    # 按 TRACK_FPS 抽帧，ByteTrack 使用抽帧后的帧率
+    stride  = max(1, fps // TRACK_FPS)
+    tracker = sv.ByteTrack(frame_rate=max(1, fps // stride))
+    seen_pairs = np.empty((0, 2), dtype=np.int64)  # 累计去重后的 (class id, tracker id) int 矩阵
 
-    model   = get_model()
-    tracker = sv.ByteTrack(frame_rate=fps)
-    unique_per_species = {}
+    # 提前结束：按原视频帧数计，出现过至少一个 track 后，连续 stall_frames 帧没有出现新的 (class, track) 就停止
+    stall_frames = fps * STALL_SECONDS
+    frame_count  = 0
+    last_new_at  = 0
+
+    if vr is not None:
+        frame_batches = _iter_decord_batches(vr, stride, BATCH_SIZE, rot_k)
+    else:
+        frame_batches = _iter_frame_batches(cap, stride, BATCH_SIZE)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    for frames in frame_batches:
+        frame_count += len(frames) * stride
+        # 一次推理整批帧，再按原顺序逐帧更新 tracker
+        results = model.predict(source=_stage_batch(frames), half=USE_HALF, verbose=False)
+        batch_cls, batch_tid = [], []
+        for result in results:
+            detections = sv.Detections.from_ultralytics(result)
+            detections = tracker.update_with_detections(detections=detections)
+            if detections.tracker_id is None or len(detections) == 0:
+                continue
+            # 直接在数组上做置信度过滤，不再构造新的 Detections
+            keep = np.flatnonzero(detections.confidence > confidence)
+            if keep.size:
+                batch_cls.append(detections.class_id[keep])
+                batch_tid.append(detections.tracker_id[keep])
+        if batch_cls:
+            # 整批 (class id, tracker id) 并入累计矩阵并去重，行数增加说明出现了新 track
+            batch_pairs = np.stack([np.concatenate(batch_cls), np.concatenate(batch_tid)], axis=1).astype(np.int64)
+            merged = np.unique(np.concatenate([seen_pairs, batch_pairs]), axis=0)
+            if len(merged) > len(seen_pairs):
+                last_new_at = frame_count
+            seen_pairs = merged
+        # 还没有任何 track 时不计时，避免开头长时间空镜头导致漏检
+        if stall_frames and len(seen_pairs) and frame_count - last_new_at > stall_frames:
+            print(f"[INFO] no new tracks for {STALL_SECONDS}s, stop at frame {frame_count}")
             break
-        result     = model(frame)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        detections = tracker.update_with_detections(detections=detections)
-        if detections.tracker_id is None:
-            continue
-        mask       = detections.confidence > confidence
-        detections = detections[mask]
-        for trk_id, cls_id in zip(detections.tracker_id.tolist(), detections.class_id.tolist()):
-            species = class_dict[int(cls_id)]
-            unique_per_species.setdefault(species, set()).add(int(trk_id))
 
-    cap.release()
-    return {species: len(ids) for species, ids in unique_per_species.items()}
+    if cap is not None:
+        cap.release()
+    if not len(seen_pairs):
+        return {}
+    # 按 class id 计数，循环结束后才把 class id 映射为物种名
+    counts_arr = np.bincount(seen_pairs[:, 0], minlength=len(class_dict))
+    return {class_dict[cls_id]: int(counts_arr[cls_id]) for cls_id in np.flatnonzero(counts_arr).tolist()}
 
 # ===== 主 handler =====
 def handler(event, context):
@@ -67,7 +281,8 @@ def handler(event, context):
     - event["detail"]["bucket"]["name"] 为 bucket
     - event["detail"]["object"]["key"] 为对象 key，例如 "video/xxx.mp4"
     """
-    print(f"[DEBUG] Raw Event: {json.dumps(event)}")
+    # 本次调用的时间戳只计算一次
+    now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
     # 从 EventBridge S3 事件中取 bucket / key
     detail = event.get("detail", {})
@@ -98,12 +313,21 @@ def handler(event, context):
         file_id, ext = filename, "mp4"
     ext = ext or "mp4"
 
+    # OpenCV 路径使用的本地文件（decord 不可用，或 decord 打不开内存中的视频时才会写入）
     tmp_video_path = f"/tmp/{file_id}.{ext}"
 
     # ===== 从 S3 下载视频（走 AWS 内部网络，不用 presigned url）=====
+    # decord 可直接读内存中的视频，省去一次 /tmp 写入和读回；OpenCV 路径仍需落盘
     try:
-        s3_client.download_file(bucket, key, tmp_video_path)
-        print(f"[INFO] S3 download complete: s3://{bucket}/{key} -> {tmp_video_path}")
+        if VideoReader is not None:
+            video_source = io.BytesIO()
+            s3_client.download_fileobj(bucket, key, video_source, Config=TRANSFER_CONFIG)
+            video_source.seek(0)
+            print(f"[INFO] S3 download complete: s3://{bucket}/{key} -> memory")
+        else:
+            s3_client.download_file(bucket, key, tmp_video_path, Config=TRANSFER_CONFIG)
+            video_source = tmp_video_path
+            print(f"[INFO] S3 download complete: s3://{bucket}/{key} -> {tmp_video_path}")
     except ClientError as e:
         print(f"[ERROR] S3 download failed: {e}")
         return {
@@ -113,7 +337,7 @@ def handler(event, context):
 
     # ===== 模型推理 =====
     try:
-        counts = video_predict_unique_counts(tmp_video_path, confidence=0.5)
+        counts = video_predict_unique_counts(video_source, confidence=0.5, fallback_path=tmp_video_path)
         print(f"[INFO] model run complete: {counts}")
     except Exception as e:
         print(f"[ERROR] model run failed: {e}")
@@ -124,45 +348,32 @@ def handler(event, context):
     video_bucket_for_url = VIDEO_BUCKET_ENV or bucket
     s3_url = f"https://{video_bucket_for_url}.s3.amazonaws.com/{key}"
 
-    # ===== 检查缩略图是否存在 =====
-    thumbnail_key = f"thumbnail/{file_id}.jpg"
-    try:
-        s3_client.head_object(Bucket=THUMB_BUCKET, Key=thumbnail_key)
-        thumbnail_url = f"https://{THUMB_BUCKET}.s3.amazonaws.com/{thumbnail_key}"
-    except ClientError:
-        thumbnail_url = ""
-
     # ===== 写入 / 更新 DynamoDB =====
-    now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     tags_map = {species: {"N": str(cnt)} for species, cnt in counts.items()}
 
     try:
-        update_expression_parts = [
-            "#S = :done",
-            "file_type = :ft",
-            "s3_url = :s",
-            "tags = :tg",
-            "upload_timestamp = :u"
-        ]
-        expression_attribute_names = {"#S": "status"}
         expression_attribute_values = {
-            ":done": {"S": "DONE"},
-            ":ft":   {"S": "Video"},
+            ":done": DONE_ATTR,
+            ":ft":   FILE_TYPE_ATTR,
             ":s":    {"S": s3_url},
             ":tg":   {"M": tags_map},
             ":u":    {"S": now_iso},
         }
-
-        if thumbnail_url:
-            update_expression_parts.append("thumbnail_url = :t")
-            expression_attribute_values[":t"] = {"S": thumbnail_url}
+        # 缩略图由 thumbnail_lambda 按确定的 key 生成，这里直接写入 thumbnail_url
+        if THUMB_BUCKET:
+            expression_attribute_values[":t"] = {
+                "S": f"https://{THUMB_BUCKET}.s3.amazonaws.com/thumbnails/{file_id}.jpg"
+            }
 
         ddb_client.update_item(
             TableName=METADATA_TABLE,
             Key={"file_id": {"S": file_id}},
-            UpdateExpression="SET " + ", ".join(update_expression_parts),
-            ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
+            UpdateExpression=UPDATE_EXPR,
+            ExpressionAttributeNames=UPDATE_EXPR_NAMES,
+            ExpressionAttributeValues=expression_attribute_values,
+            # 不需要返回旧/新属性和容量信息，减小响应体
+            ReturnValues="NONE",
+            ReturnConsumedCapacity="NONE",
         )
         print(
             f"[INFO] DynamoDB updated: file_id={file_id}, "
@@ -173,7 +384,7 @@ def handler(event, context):
         # 根据需要决定是否要抛出异常让 Lambda 失败重试
         raise
 
-    # ===== 清理临时文件 =====
+    # ===== 清理临时文件（只在 OpenCV 路径下存在）=====
     try:
         os.remove(tmp_video_path)
     except OSError:
@@ -190,4 +401,8 @@ def handler(event, context):
                 "tags": counts,
             }
         ),
-    }
\ No newline at end of file
+    }
+
+
+# ===== INIT 阶段预加载模型 =====
+get_model()
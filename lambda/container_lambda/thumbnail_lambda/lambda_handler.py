@@ -4,34 +4,151 @@
 import os
 import json
 import boto3
+from boto3.s3.transfer import TransferConfig
 import cv2 as cv
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+try:
+    import av
+except ImportError:  # PyAV 不可用时只用 OpenCV
+    av = None
+
 REGION         = os.getenv("AWS_REGION", "ap-southeast-2")
 IMAGES_BUCKET  = os.getenv("IMAGES_S3")          # 可选，用于区分不同 bucket
 VIDEO_BUCKET   = os.getenv("VIDEO_S3")
 THUMB_BUCKET   = os.getenv("THUMBNAILS_S3")
 METADATA_TABLE = os.getenv("METADATA_TABLE")
 
-s3_client  = boto3.client("s3", region_name=REGION)
-ddb_client = boto3.client("dynamodb", region_name=REGION)
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "standard", "max_attempts": 3},
+    tcp_keepalive=True,
+)
+
+s3_client  = boto3.client("s3", region_name=REGION, config=BOTO_CONFIG)
+ddb_client = boto3.client("dynamodb", region_name=REGION, config=BOTO_CONFIG)
+
+# 大文件分片并发下载
+TRANSFER_CONFIG = TransferConfig(multipart_chunksize=8 << 20, max_concurrency=10, use_threads=True)
+
+
+# JPEG 可以在 IDCT 阶段直接解码出 1/4、1/2 尺寸：(缩小倍数, imread flag)，按倍数从大到小
+JPEG_REDUCED_DECODES = (
+    (4, cv.IMREAD_REDUCED_COLOR_4),
+    (2, cv.IMREAD_REDUCED_COLOR_2),
+)
+
+# 带宽高信息的 SOF 段（排除 DHT / JPG / DAC）
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def read_jpeg_size(source_path: str):
+    """
+    只读 JPEG 段头，从 SOF 段取出 (宽, 高)，不解码图像数据；不是合法 JPEG 时返回 None
+    """
+    with open(source_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":  # 填充字节
+                marker = f.read(1)
+            if not marker:
+                return None
+            code = marker[0]
+            if code == 0xD8 or 0xD0 <= code <= 0xD7 or code == 0x01:
+                continue  # 无长度字段的独立 marker
+            if code in (0xD9, 0xDA):  # EOI / SOS 之前还没遇到 SOF
+                return None
+            header = f.read(2)
+            if len(header) < 2:
+                return None
+            length = int.from_bytes(header, "big")
+            if code in JPEG_SOF_MARKERS:
+                sof = f.read(5)  # precision(1) + height(2) + width(2)
+                if len(sof) < 5:
+                    return None
+                return int.from_bytes(sof[3:5], "big"), int.from_bytes(sof[1:3], "big")
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_for_thumbnail(source_path: str, max_width: int):
+    """
+    JPEG 根据头部记录的尺寸选一个缩小倍数，只解码一次；其他格式或尺寸不足时全尺寸读取
+    """
+    if source_path.lower().endswith((".jpg", ".jpeg")):
+        size = read_jpeg_size(source_path)
+        if size:
+            # EXIF 方向可能让宽高互换，按短边判断，保证解码结果宽度不小于 max_width
+            short_side = min(size)
+            for factor, flag in JPEG_REDUCED_DECODES:
+                if short_side // factor >= max_width:
+                    img = cv.imread(source_path, flag)
+                    if img is not None:
+                        return img
+                    break
+    return cv.imread(source_path)
 
 
-def generate_image_thumbnail(source_path: str, dest_path: str, max_width: int = 200):
-    img = cv.imread(source_path)
+def encode_jpeg(img) -> bytes:
+    ok, buf = cv.imencode(".jpg", img, [int(cv.IMWRITE_JPEG_QUALITY), 85])
+    if not ok:
+        raise RuntimeError("Cannot encode thumbnail as JPEG")
+    return buf.tobytes()
+
+
+def generate_image_thumbnail(source_path: str, max_width: int = 200) -> bytes:
+    img = read_image_for_thumbnail(source_path, max_width)
     if img is None:
         raise RuntimeError(f"Cannot read image: {source_path}")
     h, w = img.shape[:2]
     if w <= max_width:
-        cv.imwrite(dest_path, img, [int(cv.IMWRITE_JPEG_QUALITY), 85])
-        return
+        return encode_jpeg(img)
     scale = max_width / float(w)
     new_dim = (max_width, int(h * scale))
-    resized = cv.resize(img, new_dim, interpolation=cv.INTER_AREA)
-    cv.imwrite(dest_path, resized, [int(cv.IMWRITE_JPEG_QUALITY), 85])
+    # 缩小超过 4 倍时用 INTER_AREA 抗混叠，否则 INTER_LINEAR 更快
+    interp = cv.INTER_AREA if scale < 0.25 else cv.INTER_LINEAR
+    resized = cv.resize(img, new_dim, interpolation=interp)
+    return encode_jpeg(resized)
+
+
+# display matrix 的逆时针旋转角度 -> cv.rotate 参数（np.rot90 的 k 取 0~3）
+ROTATE_CODES = {
+    1: cv.ROTATE_90_COUNTERCLOCKWISE,
+    2: cv.ROTATE_180,
+    3: cv.ROTATE_90_CLOCKWISE,
+}
+
 
+def apply_display_rotation(img, rotation):
+    """
+    按 display matrix 旋转角度（度，逆时针）摆正画面；OpenCV 读视频时默认会做这一步（CAP_PROP_ORIENTATION_AUTO），PyAV 不会
+    """
+    k = round((rotation or 0) / 90) % 4
+    return cv.rotate(img, ROTATE_CODES[k]) if k else img
+
+
+def read_first_video_frame(source_path: str):
+    """
+    只解码第一帧：优先用 PyAV（多线程解码，到第一帧即停止），失败时回退到 OpenCV
+    """
+    if av is not None:
+        try:
+            with av.open(source_path) as container:
+                stream = container.streams.video[0]
+                stream.thread_type = "AUTO"
+                frame = next(container.decode(stream))
+                # 竖屏手机视频带旋转信息，需要手动摆正，否则缩略图是横着的
+                return apply_display_rotation(frame.to_ndarray(format="bgr24"), frame.rotation)
+        except Exception as e:
+            print(f"[WARN] PyAV failed to read first frame, fall back to OpenCV: {e}")
 
-def generate_video_thumbnail(source_path: str, dest_path: str, max_width: int = 200):
     cap = cv.VideoCapture(source_path)
     if not cap.isOpened():
         raise RuntimeError(f"Unable to open video: {source_path}")
@@ -39,19 +156,23 @@ def generate_video_thumbnail(source_path: str, dest_path: str, max_width: int =
     cap.release()
     if not ret or frame is None:
         raise RuntimeError(f"Cannot read the first frame: {source_path}")
+    return frame
+
+
+def generate_video_thumbnail(source_path: str, max_width: int = 200) -> bytes:
+    frame = read_first_video_frame(source_path)
     h, w = frame.shape[:2]
     if w <= max_width:
-        cv.imwrite(dest_path, frame, [int(cv.IMWRITE_JPEG_QUALITY), 85])
-        return
+        return encode_jpeg(frame)
     scale = max_width / float(w)
     new_dim = (max_width, int(h * scale))
-    resized = cv.resize(frame, new_dim, interpolation=cv.INTER_AREA)
-    cv.imwrite(dest_path, resized, [int(cv.IMWRITE_JPEG_QUALITY), 85])
+    # 缩小超过 4 倍时用 INTER_AREA 抗混叠，否则 INTER_LINEAR 更快
+    interp = cv.INTER_AREA if scale < 0.25 else cv.INTER_LINEAR
+    resized = cv.resize(frame, new_dim, interpolation=interp)
+    return encode_jpeg(resized)
 
 
 def handler(event, context):
-    print(f"[DEBUG] Raw EventBridge event: {json.dumps(event)}")
-
     # 这里假定一定是 EventBridge 转发的 S3 Object Created 事件
     # 结构类似：
     # {
@@ -96,23 +217,22 @@ def handler(event, context):
     _, ext = os.path.splitext(key)
     ext = ext.lstrip(".") or "jpg"
     tmp_src   = f"/tmp/{file_id}.{ext}"
-    tmp_thumb = f"/tmp/{file_id}.jpg"
 
     # 从 S3 下载源文件（内部网络）
     try:
-        s3_client.download_file(bucket, key, tmp_src)
+        s3_client.download_file(bucket, key, tmp_src, Config=TRANSFER_CONFIG)
         print(f"[INFO] S3 downloaded: s3://{bucket}/{key} -> {tmp_src}")
     except ClientError as e:
         print(f"[ERROR] failed to download: bucket={bucket}, key={key}, error={e}")
         raise
 
-    # 生成缩略图
+    # 生成缩略图（直接编码到内存）
     try:
         if dirname == "image":
-            generate_image_thumbnail(tmp_src, tmp_thumb)
+            thumb_bytes = generate_image_thumbnail(tmp_src)
         else:
-            generate_video_thumbnail(tmp_src, tmp_thumb)
-        print(f"[INFO] thumbnail generated at {tmp_thumb}")
+            thumb_bytes = generate_video_thumbnail(tmp_src)
+        print(f"[INFO] thumbnail generated: {len(thumb_bytes)} bytes")
     except Exception as e:
         print(f"[ERROR] failed to generate thumbnail: {e}")
         try:
@@ -121,12 +241,16 @@ def handler(event, context):
             pass
         raise
 
-    # 上传缩略图到 THUMB_BUCKET
+    # 缩略图 key 是确定的：视频的 thumbnail_url 由 video tagging lambda 写入（推理远慢于抽首帧），
+    # 图片由这里在上传完成后写入，保证前端收到的 URL 对应的缩略图已存在
     thumb_key = f"thumbnails/{file_id}.jpg"
+    thumbnail_url = f"https://{THUMB_BUCKET}.s3.amazonaws.com/{thumb_key}"
+
+    # 上传缩略图到 THUMB_BUCKET
     try:
-        s3_client.upload_file(
-            tmp_thumb, THUMB_BUCKET, thumb_key,
-            ExtraArgs={"ContentType": "image/jpeg"}
+        s3_client.put_object(
+            Bucket=THUMB_BUCKET, Key=thumb_key,
+            Body=thumb_bytes, ContentType="image/jpeg"
         )
         print(f"[INFO] thumbnail uploaded: s3://{THUMB_BUCKET}/{thumb_key}")
     except ClientError as e:
@@ -135,35 +259,30 @@ def handler(event, context):
             os.remove(tmp_src)
         except OSError:
             pass
-        try:
-            os.remove(tmp_thumb)
-        except OSError:
-            pass
         raise
 
-    thumbnail_url = f"https://{THUMB_BUCKET}.s3.amazonaws.com/{thumb_key}"
+    # 图片：缩略图上传完成后再写 thumbnail_url，DynamoDB Streams 会再推送一次 FILE_UPDATE
+    if dirname == "image":
+        try:
+            ddb_client.update_item(
+                TableName=METADATA_TABLE,
+                Key={"file_id": {"S": file_id}},
+                UpdateExpression="SET thumbnail_url = :t",
+                ExpressionAttributeValues={":t": {"S": thumbnail_url}},
+                ReturnValues="NONE",
+                ReturnConsumedCapacity="NONE",
+            )
+            print(f"[INFO] update DynamoDB thumbnail_url: {file_id} -> {thumbnail_url}")
+        except ClientError as e:
+            print(f"[ERROR] DynamoDB update thumbnail_url failed: {e}")
+            # 可以根据需要决定是否 raise，这里先不抛出去
 
-    # 更新 DynamoDB
+    # 清理临时文件
     try:
-        ddb_client.update_item(
-            TableName=METADATA_TABLE,
-            Key={"file_id": {"S": file_id}},
-            UpdateExpression="SET thumbnail_url = :t",
-            ExpressionAttributeValues={":t": {"S": thumbnail_url}}
-        )
-        print(f"[INFO] update DynamoDB thumbnail_url: {file_id} -> {thumbnail_url}")
-    except ClientError as e:
-        print(f"[ERROR] DynamoDB update thumbnail_url failed: {e}")
-        # 可以根据需要决定是否 raise，这里先不抛出去
+        os.remove(tmp_src)
+    except OSError:
         pass
 
-    # 清理临时文件
-    for path in (tmp_src, tmp_thumb):
-        try:
-            os.remove(path)
-        except OSError:
-            pass
-
     return {
         "statusCode": 200,
         "body": json.dumps({